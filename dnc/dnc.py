@@ -8,7 +8,8 @@ import utility
 class DNC:
 
     def __init__(self, controller_class, input_size, output_size, max_sequence_length,
-                 memory_words_num=256, memory_word_size=64, memory_read_heads=4, batch_size=1):
+                 memory_words_num=256, memory_word_size=64, memory_read_heads=4, batch_size=1,
+                 input_data=None, target_output=None):
         """
         constructs a complete DNC architecture as described in the DNC paper
         http://www.nature.com/nature/journal/vaop/ncurrent/full/nature20101.html
@@ -31,6 +32,11 @@ class DNC:
             the number of read heads in the memory
         batch_size: int
             the size of the data batch
+        input_data: Tensor (batch_size, time_steps, input_size)
+            a tensor to use as the input instead of a placeholder [optional]
+        target_output: Tensor (batch_size, time_steps, output_size) or (batch_size, time_steps)
+            a tensor to use as the target output instead of a placeholder, e.g. integer
+            class ids for a sparse loss [optional]
         """
 
         self.input_size = input_size
@@ -45,9 +51,13 @@ class DNC:
         self.controller = controller_class(self.input_size, self.output_size, self.read_heads, self.word_size,
                                            self.batch_size)
 
-        # input data placeholders
-        self.input_data = tf.compat.v1.placeholder(tf.float32, [batch_size, None, input_size], name='input')
-        self.target_output = tf.compat.v1.placeholder(tf.float32, [batch_size, None, output_size], name='targets')
+        # input data placeholders, unless the caller already provides the tensors
+        if input_data is None:
+            input_data = tf.compat.v1.placeholder(tf.float32, [batch_size, None, input_size], name='input')
+        if target_output is None:
+            target_output = tf.compat.v1.placeholder(tf.float32, [batch_size, None, output_size], name='targets')
+        self.input_data = input_data
+        self.target_output = target_output
         self.sequence_length = tf.compat.v1.placeholder(tf.int32, name='sequence_length')
 
         self.build_graph()
@@ -0,0 +1,94 @@
+import warnings
+
+warnings.filterwarnings('ignore')
+
+import tensorflow as tf
+import numpy as np
+import getopt
+import shutil
+import json
+import sys
+import os
+
+from train import llprint, load, encode_sample
+
+
+def int64_feature(values):
+    """
+    Wrap a sequence of integers into a tf.train.Feature.
+    :param values: The integers to store.
+    :return: A tf.train.Feature holding values as an int64 list.
+    """
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=values))
+
+
+def float_feature(values):
+    """
+    Wrap a sequence of floats into a tf.train.Feature.
+    :param values: The floats to store.
+    :return: A tf.train.Feature holding values as a float list.
+    """
+    return tf.train.Feature(float_list=tf.train.FloatList(value=values))
+
+
+def make_example(sample, target_code):
+    """
+    Encode a sample as a tf.train.Example holding its integer input/output codes, its length and its weights.
+    :param sample: An encoded sample as stored by preprocess.py.
+    :param target_code: code indicating end of sample and beginning of answer.
+    :return: The tf.train.Example for the sample.
+    """
+    input_vec, output_vec, weights_vec = encode_sample(sample, target_code)
+    return tf.train.Example(features=tf.train.Features(feature={
+        'input_ids': int64_feature(input_vec.astype(np.int64)),
+        'target_ids': int64_feature(output_vec.astype(np.int64)),
+        'seq_len': int64_feature([input_vec.shape[0]]),
+        'weights': float_feature(weights_vec)
+    }))
+
+
+def main():
+    """
+    Convert the encoded DREAM training samples into sharded TFRecord files that train.py streams from. Only needs to
+    be run once after preprocess.py.
+    :return: None.
+    """
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(dirname, 'data', 'encoded')
+    records_dir = os.path.join(data_dir, 'records')
+    num_shards = 8
+
+    options, _ = getopt.getopt(sys.argv[1:], '', ['shards='])
+
+    for opt in options:
+        if opt[0] == '--shards':
+            num_shards = int(opt[1])
+
+    lexicon_dict = load(os.path.join(data_dir, 'lexicon-dict.pkl'))
+    target_code = lexicon_dict['=']
+    data_files = [os.path.join(data_dir, 'train', f) for f in os.listdir(os.path.join(data_dir, 'train'))
+                  if f.endswith('.json')]
+
+    if os.path.exists(records_dir):
+        shutil.rmtree(records_dir)
+    os.mkdir(records_dir)
+
+    writers = [
+        tf.io.TFRecordWriter(os.path.join(records_dir, 'train-%05d-of-%05d.tfrecord' % (shard, num_shards)))
+        for shard in range(num_shards)
+    ]
+
+    llprint("Writing TFRecords ... 0/%d" % len(data_files))
+    for i, data_file in enumerate(data_files):
+        with open(data_file) as f:
+            sample = json.load(f)
+        writers[i % num_shards].write(make_example(sample, target_code).SerializeToString())
+        llprint("\rWriting TFRecords ... %d/%d" % (i + 1, len(data_files)))
+
+    for writer in writers:
+        writer.close()
+    llprint("\rWriting TFRecords ... Done!\n")
+
+
+if __name__ == '__main__':
+    main()
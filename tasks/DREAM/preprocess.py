@@ -353,7 +353,8 @@ def main():
 
     llprint("Saving processed data to disk ... ")
 
-    pickle.dump(lexicon_dictionary, open(join(processed_data_dir, 'lexicon-dict.pkl'), 'wb'))
+    with open(join(processed_data_dir, 'lexicon-dict.pkl'), 'wb') as write_file:
+        pickle.dump(lexicon_dictionary, write_file, pickle.HIGHEST_PROTOCOL)
 
     joint_train_data = []
 
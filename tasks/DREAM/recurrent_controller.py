@@ -25,3 +25,77 @@ class RecurrentController(BaseController):
     @staticmethod
     def update_state(new_state):
         return tf.no_op()
+
+
+def _lstm_block_cell_grad(op, *grad):
+    """
+    Gradient of the LSTMBlockCell op, as tf.contrib registered it before it was removed in TF 2.x. The op's
+    LSTMBlockCellGrad kernel backpropagates into the gates, the rest follows from xh * w + b.
+    """
+    x, cs_prev, h_prev, w, wci, wcf, wco, b = op.inputs
+    i, cs, f, o, ci, co, _ = op.outputs
+    _, cs_grad, _, _, _, _, h_grad = grad
+
+    input_size = tf.shape(x)[1]
+    cs_prev_grad, dicfo, wci_grad, wcf_grad, wco_grad = tf.raw_ops.LSTMBlockCellGrad(
+        x=x, cs_prev=cs_prev, h_prev=h_prev, w=w, wci=wci, wcf=wcf, wco=wco, b=b,
+        i=i, cs=cs, f=f, o=o, ci=ci, co=co, cs_grad=cs_grad, h_grad=h_grad,
+        use_peephole=op.get_attr("use_peephole")
+    )
+
+    xh_grad = tf.matmul(dicfo, w, transpose_b=True)
+    x_grad = xh_grad[:, :input_size]
+    h_prev_grad = xh_grad[:, input_size:]
+    w_grad = tf.matmul(tf.concat([x, h_prev], 1), dicfo, transpose_a=True)
+    b_grad = tf.reduce_sum(dicfo, 0)
+
+    return x_grad, cs_prev_grad, h_prev_grad, w_grad, wci_grad, wcf_grad, wco_grad, b_grad
+
+
+try:
+    tf.RegisterGradient("LSTMBlockCell")(_lstm_block_cell_grad)
+except KeyError:
+    # already registered by this TensorFlow build
+    pass
+
+
+class FusedRecurrentController(RecurrentController):
+    """
+    The same LSTM as RecurrentController, but every step runs as the single fused LSTMBlockCell kernel (the op
+    behind LSTMBlockCell) instead of a chain of matmul, split and activation ops. The variables keep
+    BasicLSTMCell's names and layout so checkpoints can be shared with RecurrentController.
+    """
+
+    def network_vars(self):
+        self.num_units = 256
+        with tf.compat.v1.variable_scope("shape_inference"):
+            with tf.compat.v1.variable_scope("basic_lstm_cell"):
+                self.kernel = tf.compat.v1.get_variable(
+                    'kernel', [self.nn_input_size + self.num_units, 4 * self.num_units]
+                )
+                self.bias = tf.compat.v1.get_variable(
+                    'bias', [4 * self.num_units], initializer=tf.compat.v1.zeros_initializer()
+                )
+        # LSTMBlockCell always takes peephole weights, they are ignored since use_peephole is False
+        self.peephole = tf.zeros([self.num_units])
+        self.state = tf.compat.v1.nn.rnn_cell.LSTMStateTuple(
+            tf.zeros([self.batch_size, self.num_units]),
+            tf.zeros([self.batch_size, self.num_units])
+        )
+
+    def network_op(self, X, state):
+        X = tf.convert_to_tensor(value=X)
+        _, cs, _, _, _, _, h = tf.raw_ops.LSTMBlockCell(
+            x=X,
+            cs_prev=state[0],
+            h_prev=state[1],
+            w=self.kernel,
+            wci=self.peephole,
+            wcf=self.peephole,
+            wco=self.peephole,
+            b=self.bias,
+            forget_bias=1.0,
+            cell_clip=-1.0,
+            use_peephole=False
+        )
+        return h, tf.compat.v1.nn.rnn_cell.LSTMStateTuple(cs, h)
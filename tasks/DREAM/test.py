@@ -99,10 +99,15 @@ if __name__ == '__main__':
                 memory_read_heads=4,
             )
 
+            latest_checkpoint = tf.compat.v1.train.latest_checkpoint(ckpts_dir)
             checkpoints = os.listdir(ckpts_dir)
-            if len(checkpoints) != 0:
-                checkpoint_numbers = [int(checkpoint[checkpoint.find("-") + 1:]) for checkpoint in checkpoints if
-                                      checkpoint[checkpoint.find("-") + 1:].isnumeric()]
+            checkpoint_numbers = [int(checkpoint[checkpoint.find("-") + 1:]) for checkpoint in checkpoints if
+                                  checkpoint.startswith("step-") and checkpoint[checkpoint.find("-") + 1:].isnumeric()]
+            if latest_checkpoint is not None:
+                # model.ckpt-N checkpoints written by train.py
+                tf.compat.v1.train.Saver(tf.compat.v1.trainable_variables()).restore(session, latest_checkpoint)
+            elif len(checkpoint_numbers) != 0:
+                # older step-N checkpoint directories
                 checkpoint_numbers.sort()
                 ncomputer.restore(session, ckpts_dir, f"step-{checkpoint_numbers[-1]}")
             else:
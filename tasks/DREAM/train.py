@@ -10,8 +10,10 @@ import time
 import sys
 import os
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from recurrent_controller import RecurrentController
+from recurrent_controller import RecurrentController, FusedRecurrentController
 sys.path.append('./dnc')
 
 from dnc.dnc import DNC
@@ -33,50 +35,167 @@ def load(path):
     :param path: The path to the pickled file.
     :return: Returns the object hierarchy stored in the file.
     """
-    return pickle.load(open(path, 'rb'))
+    with open(path, 'rb') as f:
+        return pickle.load(f)
 
 
-def onehot(index, size):
+def encode_sample(sample, target_code):
     """
-    Create a numpy vector that has all zeros except at index. index has the value 1.
-    :param index: The index where the vector should be one.
-    :param size: The length of the vector.
-    :return: A one-hot vector encoding for the given index.
+    Split a sample into its encoded input and output sequences.
+    :param sample: the dialogue connected by '+' characters followed by the '\' character and then a question. Where
+                    the question is followed by the target_code and the answer (with all words encoded).
+    :param target_code: code indicating end of sample and beginning of answer (also used in input as
+                        a replacement for each letter in the answer.
+    :return: tuple including input codes, output codes, and associated weights.
     """
-    vec = np.zeros(size, dtype=np.float32)
-    vec[index] = 1.0
-    return vec
+    split = sample.index(target_code)
+    input_vec = np.array(sample[:split], dtype=np.intp)
+    output_vec = np.array(sample[split + 1:], dtype=np.intp)
+    if len(output_vec) < len(input_vec):
+        output_vec = np.pad(output_vec, (0, len(input_vec) - len(output_vec)), constant_values=target_code)
+    weights_vec = (output_vec != target_code).astype(np.float32)
 
+    return input_vec, output_vec, weights_vec
 
-def prepare_sample(sample, target_code, word_space_size):
+
+def prepare_sample(sample, target_code):
     """
     Transform a sample into input and output vectors.
     :param sample: the dialogue connected by '+' characters followed by the '\' character and then a question. Where
                     the question is followed by the target_code and the answer (with all words encoded).
     :param target_code: code indicating end of sample and beginning of answer (also used in input as
                         a replacement for each letter in the answer.
-    :param word_space_size: how many total letters exist.
-    :return: tuple including input vector, output vector, length of sequence, and associated weights.
+    :return: tuple including input codes, output codes, length of sequence, and associated weights.
     """
-    input_vec = np.array(sample[:sample.index(target_code)], dtype=np.float32)
-    output_vec = sample[sample.index(target_code) + 1:]
-    while len(output_vec) < len(input_vec):
-        output_vec.append(target_code)
-    output_vec = np.array(output_vec, dtype=np.float32)
+    input_vec, output_vec, weights_vec = encode_sample(sample, target_code)
     seq_len = input_vec.shape[0]
-    weights_vec = np.zeros(seq_len, dtype=np.float32)
-
-    target_mask = (output_vec != target_code)
-    weights_vec[target_mask] = 1.0
-    input_vec = np.array([onehot(int(code), word_space_size) for code in input_vec])
-    output_vec = np.array([onehot(int(code), word_space_size) for code in output_vec])
 
     return (
-        np.reshape(input_vec, (1, -1, word_space_size)),
-        np.reshape(output_vec, (1, -1, word_space_size)),
+        input_vec.astype(np.int32),
+        output_vec.astype(np.int32),
         seq_len,
-        np.reshape(weights_vec, (1, -1, 1))
+        np.reshape(weights_vec, (-1, 1))
+    )
+
+
+def parse_example(serialized):
+    """
+    Decode a serialized tf.train.Example written by make_tfrecords.py into input and output codes.
+    :param serialized: A scalar string tensor holding the serialized example.
+    :return: tuple including input codes, output codes, length of sequence, and associated weights.
+    """
+    features = tf.io.parse_single_example(serialized, {
+        'input_ids': tf.io.VarLenFeature(tf.int64),
+        'target_ids': tf.io.VarLenFeature(tf.int64),
+        'seq_len': tf.io.FixedLenFeature([], tf.int64),
+        'weights': tf.io.VarLenFeature(tf.float32)
+    })
+    input_ids = tf.cast(tf.sparse.to_dense(features['input_ids']), tf.int32)
+    target_ids = tf.cast(tf.sparse.to_dense(features['target_ids']), tf.int32)
+    weights = tf.sparse.to_dense(features['weights'])
+
+    return (
+        input_ids,
+        target_ids,
+        tf.cast(features['seq_len'], tf.int32),
+        tf.reshape(weights, (-1, 1))
+    )
+
+
+def load_sample(path, target_code):
+    """
+    Read an encoded sample from disk and transform it into input and output codes.
+    :param path: The path to the json file holding the encoded sample.
+    :param target_code: code indicating end of sample and beginning of answer.
+    :return: tuple including input codes, output codes, length of sequence, and associated weights.
+    """
+    with open(path) as f:
+        sample = json.load(f)
+    return prepare_sample(sample, target_code)
+
+
+def unordered_options():
+    """
+    Create dataset options that let parallel map calls return samples as soon as they are ready. The samples are
+    shuffled anyway, so a slow file no longer holds back the ones decoded after it.
+    :return: A tf.data.Options object.
+    """
+    options = tf.data.Options()
+    options.experimental_deterministic = False
+    return options
+
+
+def batch_samples(dataset, batch_size, target_code, bucket_boundaries=(64, 128, 256, 512)):
+    """
+    Group samples of similar length into padded batches. Inputs and outputs are padded with target_code and the
+    weights with zeros, so padded steps do not contribute to the loss.
+    :param dataset: A tf.data.Dataset yielding single (input codes, output codes, length of sequence, weights) samples.
+    :param batch_size: The number of samples per batch.
+    :param target_code: code indicating end of sample and beginning of answer.
+    :param bucket_boundaries: The sequence lengths at which samples are split into separate buckets.
+    :return: A tf.data.Dataset yielding batches where the length of sequence is that of the longest sample.
+    """
+    dataset = dataset.apply(tf.data.experimental.bucket_by_sequence_length(
+        element_length_func=lambda input_vec, output_vec, seq_len, weights_vec: seq_len,
+        bucket_boundaries=list(bucket_boundaries),
+        bucket_batch_sizes=[batch_size] * (len(bucket_boundaries) + 1),
+        padded_shapes=([None], [None], [], [None, 1]),
+        padding_values=(target_code, target_code, 0, 0.0)
+    ))
+    # the DNC unrolls the whole batch up to its longest sample
+    return dataset.map(
+        lambda input_vec, output_vec, seq_len, weights_vec: (input_vec, output_vec, tf.reduce_max(seq_len), weights_vec)
+    )
+
+
+def make_dataset(data_files, target_code, batch_size):
+    """
+    Build an endless, shuffled input pipeline over the encoded training samples. Samples are read and prepared on
+    background threads so that disk access and decoding overlap with the training step.
+    :param data_files: The paths to the encoded training samples.
+    :param target_code: code indicating end of sample and beginning of answer.
+    :param batch_size: The number of samples per batch.
+    :return: A tf.data.Dataset yielding (input codes, output codes, length of sequence, weights) batches.
+    """
+    def parse(path):
+        return load_sample(path.numpy().decode(), target_code)
+
+    def load_tensors(path):
+        input_vec, output_vec, seq_len, weights_vec = tf.py_function(
+            parse, [path], [tf.int32, tf.int32, tf.int32, tf.float32]
+        )
+        # py_function drops the static shapes needed for padded batching
+        input_vec.set_shape([None])
+        output_vec.set_shape([None])
+        seq_len.set_shape([])
+        weights_vec.set_shape([None, 1])
+        return input_vec, output_vec, seq_len, weights_vec
+
+    dataset = tf.data.Dataset.from_tensor_slices(data_files)
+    dataset = dataset.shuffle(len(data_files)).repeat()
+    dataset = dataset.map(load_tensors, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    dataset = batch_samples(dataset, batch_size, target_code)
+    return dataset.with_options(unordered_options()).prefetch(tf.data.experimental.AUTOTUNE)
+
+
+def make_record_dataset(record_files, target_code, batch_size, shuffle_buffer=10000):
+    """
+    Build an endless, shuffled input pipeline over the TFRecord shards written by make_tfrecords.py. This avoids
+    decoding json in Python on every step.
+    :param record_files: The paths to the TFRecord shards.
+    :param target_code: code indicating end of sample and beginning of answer.
+    :param batch_size: The number of samples per batch.
+    :param shuffle_buffer: The number of examples to shuffle across.
+    :return: A tf.data.Dataset yielding (input codes, output codes, length of sequence, weights) batches.
+    """
+    dataset = tf.data.TFRecordDataset(record_files, num_parallel_reads=tf.data.experimental.AUTOTUNE)
+    dataset = dataset.shuffle(shuffle_buffer).repeat()
+    dataset = dataset.map(
+        parse_example,
+        num_parallel_calls=tf.data.experimental.AUTOTUNE
     )
+    dataset = batch_samples(dataset, batch_size, target_code)
+    return dataset.with_options(unordered_options()).prefetch(tf.data.experimental.AUTOTUNE)
 
 
 def main():
@@ -93,13 +212,20 @@ def main():
 
     llprint("Loading Data ... ")
     lexicon_dict = load(os.path.join(data_dir, 'lexicon-dict.pkl'))
-    data_files = os.listdir(os.path.join(data_dir, 'train'))
+    target_code = lexicon_dict['=']
+    keys_list = list(lexicon_dict.keys())
+    word_space_size = len(lexicon_dict)
+    data_files = [os.path.join(data_dir, 'train', f) for f in os.listdir(os.path.join(data_dir, 'train'))
+                  if f.endswith('.json')]
+    records_dir = os.path.join(data_dir, 'records')
+    record_files = []
+    if os.path.isdir(records_dir):
+        record_files = [os.path.join(records_dir, f) for f in os.listdir(records_dir) if f.endswith('.tfrecord')]
     llprint("Done!\n")
 
-    batch_size = 1
-    input_size = output_size = len(lexicon_dict)
+    batch_size = 8
+    input_size = output_size = word_space_size
     sequence_max_length = 100
-    word_space_size = len(lexicon_dict)
     words_count = 256
     word_size = 64
     read_heads = 4
@@ -111,8 +237,13 @@ def main():
     iterations = 100000
 
     start_step = 0
+    enable_hist_summaries = False
+    enable_xla = False
+    controllers = {'basic': RecurrentController, 'fused': FusedRecurrentController}
+    controller_class = RecurrentController
 
-    options, _ = getopt.getopt(sys.argv[1:], '', ['checkpoint=', 'iterations=', 'start='])
+    options, _ = getopt.getopt(sys.argv[1:], '', ['checkpoint=', 'iterations=', 'start=', 'batch_size=',
+                                                  'controller=', 'hist_summaries', 'xla'])
 
     for opt in options:
         if opt[0] == '--checkpoint':
@@ -122,50 +253,94 @@ def main():
             iterations = int(opt[1])
         elif opt[0] == '--start':
             start_step = int(opt[1])
+        elif opt[0] == '--batch_size':
+            batch_size = int(opt[1])
+        elif opt[0] == '--controller':
+            if opt[1] not in controllers:
+                raise ValueError("controller must be one of: %s" % ", ".join(controllers))
+            controller_class = controllers[opt[1]]
+        elif opt[0] == '--hist_summaries':
+            enable_hist_summaries = True
+        elif opt[0] == '--xla':
+            enable_xla = True
+
+    # XLA can fuse the many small element-wise ops of the controller and memory, but every new padded batch length
+    # recompiles the clusters outside the sequence loop, so it is opt-in
+    config = tf.compat.v1.ConfigProto()
+    if enable_xla:
+        config.graph_options.optimizer_options.global_jit_level = tf.compat.v1.OptimizerOptions.ON_2
 
     graph = tf.Graph()
     with graph.as_default():
-        with tf.compat.v1.Session(graph=graph) as session:
+        with tf.compat.v1.Session(graph=graph, config=config) as session:
 
             llprint("Building Computational Graph ... ")
 
             optimizer = tf.compat.v1.train.RMSPropOptimizer(learning_rate, momentum=momentum)
             summarizer = tf.compat.v1.summary.FileWriter(tb_logs_dir, session.graph)
 
+            # words are fed as integer codes and only expanded to one-hot vectors on-graph
+            input_ids = tf.compat.v1.placeholder(tf.int32, [batch_size, None], name='input_ids')
+            target_ids = tf.compat.v1.placeholder(tf.int32, [batch_size, None], name='target_ids')
+
             ncomputer = DNC(
-                RecurrentController,
+                controller_class,
                 input_size,
                 output_size,
                 sequence_max_length,
                 words_count,
                 word_size,
                 read_heads,
-                batch_size
+                batch_size,
+                input_data=tf.one_hot(input_ids, input_size),
+                target_output=target_ids
             )
 
             output, _ = ncomputer.get_outputs()
+            softmaxed = tf.nn.softmax(output)
+
+            if len(record_files) != 0:
+                llprint("\n\tReading %d TFRecord shards from %s\n" % (len(record_files), records_dir))
+                dataset = make_record_dataset(record_files, target_code, batch_size)
+            else:
+                llprint("\n\tReading %d json samples from %s\n" % (len(data_files), os.path.join(data_dir, 'train')))
+                dataset = make_dataset(data_files, target_code, batch_size)
+            next_sample = tf.compat.v1.data.make_one_shot_iterator(dataset).get_next()
 
             loss_weights = tf.compat.v1.placeholder(tf.float32, [batch_size, None, 1])
-            loss = tf.reduce_mean(
-                loss_weights * tf.nn.softmax_cross_entropy_with_logits(logits=output, labels=ncomputer.target_output)
-            )
+            cross_entropy = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=output,
+                                                                           labels=ncomputer.target_output)
+            # average over the weighted (answer) steps only, so padding in a batch does not dilute the loss
+            mask = tf.squeeze(loss_weights, -1)
+            loss = tf.reduce_sum(mask * cross_entropy) / tf.maximum(tf.reduce_sum(mask), 1.)
 
             summaries = []
 
-            gradients = optimizer.compute_gradients(loss)
-            for i, (grad, var) in enumerate(gradients):
-                if grad is not None:
-                    gradients[i] = (tf.clip_by_value(grad, -10, 10), var)
-            for (grad, var) in gradients:
-                if grad is not None:
-                    summaries.append(tf.compat.v1.summary.histogram(var.name + '/grad', grad))
+            gradients = [
+                (tf.clip_by_value(grad, -10, 10), var) if grad is not None else (grad, var)
+                for grad, var in optimizer.compute_gradients(loss)
+            ]
+            if enable_hist_summaries:
+                for (grad, var) in gradients:
+                    if grad is not None:
+                        summaries.append(tf.compat.v1.summary.histogram(var.name + '/grad', grad))
 
             apply_gradients = optimizer.apply_gradients(gradients)
 
             summaries.append(tf.compat.v1.summary.scalar("Loss", loss))
 
             summarize_op = tf.compat.v1.summary.merge(summaries)
-            no_summarize = tf.no_op()
+
+            # checkpoints are written from copies of the weights taken between two steps, so a save running in the
+            # background never mixes values from different steps
+            trainable_variables = tf.compat.v1.trainable_variables()
+            with tf.compat.v1.name_scope('checkpoint_snapshot'):
+                snapshots = [
+                    tf.Variable(tf.zeros(var.shape, dtype=var.dtype.base_dtype), trainable=False,
+                                name=var.op.name.replace('/', '_'))
+                    for var in trainable_variables
+                ]
+            snapshot_op = tf.group(*[snapshot.assign(var) for snapshot, var in zip(snapshots, trainable_variables)])
 
             llprint("Done!\n")
 
@@ -173,20 +348,42 @@ def main():
             session.run(tf.compat.v1.global_variables_initializer())
             llprint("Done!\n")
 
+            # the snapshots are saved under the names of the variables they copy, so either saver can restore them
+            saver = tf.compat.v1.train.Saver(trainable_variables)
+            snapshot_saver = tf.compat.v1.train.Saver(
+                {var.op.name: snapshot for var, snapshot in zip(trainable_variables, snapshots)},
+                max_to_keep=3,
+                save_relative_paths=True
+            )
+            checkpoint_prefix = os.path.join(ckpts_dir, 'model.ckpt')
+            latest_checkpoint = tf.compat.v1.train.latest_checkpoint(ckpts_dir)
+
             if from_checkpoint is not None:
                 llprint("Restoring Checkpoint %s ... " % from_checkpoint)
-                ncomputer.restore(session, ckpts_dir, from_checkpoint)
+                if os.path.isdir(os.path.join(ckpts_dir, from_checkpoint)):
+                    ncomputer.restore(session, ckpts_dir, from_checkpoint)
+                else:
+                    saver.restore(session, os.path.join(ckpts_dir, from_checkpoint))
+                llprint("Done!\n")
+            elif latest_checkpoint is not None:
+                llprint("Restoring Checkpoint %s ... " % latest_checkpoint)
+                saver.restore(session, latest_checkpoint)
                 llprint("Done!\n")
+                start = int(latest_checkpoint[latest_checkpoint.rfind("-") + 1:])
+                end = 100000
             elif os.path.exists(ckpts_dir):
-                checkpoints = os.listdir(ckpts_dir)
-                if len(checkpoints) != 0 and any("step-" in s for s in checkpoints):
-                    checkpoint_numbers = [int(checkpoint[checkpoint.find("-") + 1:]) for checkpoint in checkpoints if checkpoint[checkpoint.find("-") + 1:].isnumeric()]
+                # fall back to the step-N directories written by DNC.save
+                checkpoint_numbers = [int(name[name.find("-") + 1:]) for name in os.listdir(ckpts_dir)
+                                      if name.startswith("step-") and name[name.find("-") + 1:].isnumeric()]
+                if len(checkpoint_numbers) != 0:
                     checkpoint_numbers.sort()
+                    llprint("Restoring Checkpoint step-%d ... " % checkpoint_numbers[-1])
                     ncomputer.restore(session, ckpts_dir, f"step-{checkpoint_numbers[-1]}")
+                    llprint("Done!\n")
                     start = checkpoint_numbers[-1]
                     end = 100000
 
-            last_100_losses = []
+            last_100_losses = deque(maxlen=100)
 
             if not 'start' in locals():
                 start = 0
@@ -200,46 +397,62 @@ def main():
             avg_100_time = 0.
             avg_counter = 0
 
+            if not os.path.exists(ckpts_dir):
+                os.makedirs(ckpts_dir)
+            checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+            checkpoint_future = None
+
+            def save_checkpoint(step):
+                # graph mode is tracked per thread, so the worker has to enter the graph itself
+                with graph.as_default():
+                    return snapshot_saver.save(session, checkpoint_prefix, global_step=step)
+
+            def report_checkpoint(future):
+                if future.exception() is not None:
+                    llprint("\nSaving Checkpoint failed: %r\n" % future.exception())
+                else:
+                    llprint("\nSaved Checkpoint %s\n" % future.result())
+
+            # callables skip parsing and validating the fetches and feed dict on every step
+            feed_list = [input_ids, target_ids, ncomputer.sequence_length, loss_weights]
+            step_fn = session.make_callable([loss, apply_gradients], feed_list=feed_list)
+            summary_step_fn = session.make_callable([loss, apply_gradients, summarize_op, softmaxed],
+                                                    feed_list=feed_list)
+
+            # the training loop must not add ops, otherwise the graph keeps growing with every iteration
+            llprint("Graph size: %d nodes\n" % len(graph.as_graph_def().node))
+            graph.finalize()
+
+            # fetch the next sample on a background thread while the current training step runs
+            executor = ThreadPoolExecutor(max_workers=1)
+            next_future = executor.submit(session.run, next_sample)
+
             for i in range(start, end + 1):
                 try:
                     llprint("\rIteration %d/%d" % (i, end))
 
-                    sample = np.random.choice(data_files, 1)
-                    with open(os.path.join(data_dir, 'train', sample[0])) as f:
-                        sample = json.load(f)
-                    input_data, target_output, seq_len, weights = prepare_sample(sample, lexicon_dict['='],
-                                                                                 word_space_size, lexicon_dict)
+                    input_data, target_output, seq_len, weights = next_future.result()
+                    next_future = executor.submit(session.run, next_sample)
 
                     summarize = (i % 100 == 0)
                     take_checkpoint = (i != 0) and (i % 200 == 0)
-                    #For debugging
-                    outputs, _ = ncomputer.get_outputs()
-                    softmaxed = tf.nn.softmax(outputs)
-
-                    loss_value, _, summary, softmax_output = session.run([
-                        loss,
-                        apply_gradients,
-                        summarize_op if summarize else no_summarize,
-                        softmaxed
-                    ], feed_dict={
-                        ncomputer.input_data: input_data,
-                        ncomputer.target_output: target_output,
-                        ncomputer.sequence_length: seq_len,
-                        loss_weights: weights
-                    })
-                    softmax_output = np.squeeze(softmax_output, axis=0)
-                    given_answers = np.argmax(softmax_output, axis=1)
-
-                    words = []
-                    for an_array in target_output[0]:
-                        for word in np.where(an_array == 1):
-                            words.extend([list(lexicon_dict.keys())[np.where(an_array == 1)[0][0]]])
+
+                    if summarize:
+                        loss_value, _, summary, softmax_output = summary_step_fn(input_data, target_output, seq_len,
+                                                                                 weights)
+                    else:
+                        loss_value, _ = step_fn(input_data, target_output, seq_len, weights)
 
                     last_100_losses.append(loss_value)
                     if summarize:
+                        softmax_output = softmax_output[0]
+                        given_answers = np.argmax(softmax_output, axis=1)
+
+                        words = [keys_list[code] for code in target_output[0]]
+
                         print("\n\tLoss value: ", loss_value)
                         print("\tTarget output: ", words)
-                        print("\tOutput: ", [list(lexicon_dict.keys())[num] for num in given_answers])
+                        print("\tOutput: ", [keys_list[num] for num in given_answers])
                         summarizer.add_summary(summary, i)
                         llprint("\tAvg. Cross-Entropy: %.7f\n" % (np.mean(last_100_losses)))
 
@@ -253,20 +466,34 @@ def main():
                         print("\tApprox. time to completion: %.2f hours\n" % estimated_time)
 
                         start_time_100 = time.time()
-                        last_100_losses = []
+                        last_100_losses = deque(maxlen=100)
 
                     if take_checkpoint:
-                        llprint("\nSaving Checkpoint ... line 237 "),
-                        ncomputer.save(session, ckpts_dir, 'step-%d' % i)
-                        llprint("Done!\n")
+                        # the previous save must be done before its snapshot is overwritten, this also raises its errors
+                        if checkpoint_future is not None:
+                            checkpoint_future.result()
+                        llprint("\nSaving Checkpoint in the background ...\n")
+                        session.run(snapshot_op)
+                        checkpoint_future = checkpoint_executor.submit(save_checkpoint, i)
+                        checkpoint_future.add_done_callback(report_checkpoint)
 
                 except KeyboardInterrupt:
 
+                    # the session is closed on exit, so no fetch may still be running on it
+                    executor.shutdown(wait=True)
+
+                    # a failed earlier save was already reported by report_checkpoint and must not prevent this one
+                    checkpoint_executor.shutdown(wait=True)
                     llprint("\nSaving Checkpoint ... "),
-                    ncomputer.save(session, ckpts_dir, 'step-%d' % i)
+                    session.run(snapshot_op)
+                    snapshot_saver.save(session, checkpoint_prefix, global_step=i)
                     llprint("Done!\n")
                     sys.exit(0)
 
+            executor.shutdown()
+            # report_checkpoint has already reported whether the last save succeeded
+            checkpoint_executor.shutdown(wait=True)
+
 
 if __name__ == '__main__':
     main()
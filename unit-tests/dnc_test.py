@@ -115,6 +115,27 @@ class DNCTest(unittest.TestCase):
                 self.assertEqual(rview['read_weightings'].shape, (3, 5, 10, 2))
                 self.assertEqual(rview['write_weightings'].shape, (3, 5, 10))
 
+    def test_external_input_data(self):
+        graph = tf.Graph()
+        with graph.as_default():
+            with tf.compat.v1.Session(graph=graph) as session:
+                input_ids = tf.compat.v1.placeholder(tf.int32, [2, None])
+                target_ids = tf.compat.v1.placeholder(tf.int32, [2, None])
+                input_data = tf.one_hot(input_ids, 10)
+                computer = DNC(DummyController, 10, 20, 10, 10, 64, 2, batch_size=2,
+                               input_data=input_data, target_output=target_ids)
+
+                self.assertIs(computer.input_data, input_data)
+                self.assertIs(computer.target_output, target_ids)
+
+                session.run(tf.compat.v1.global_variables_initializer())
+                out, _ = session.run(computer.get_outputs(), feed_dict={
+                    input_ids: np.random.randint(0, 10, (2, 5)),
+                    computer.sequence_length: 5
+                })
+
+                self.assertEqual(out.shape, (2, 5, 20))
+
     def test_save(self):
         graph = tf.Graph()
         with graph.as_default():
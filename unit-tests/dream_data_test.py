@@ -0,0 +1,80 @@
+import tensorflow as tf
+import numpy as np
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks', 'DREAM'))
+
+from train import encode_sample, prepare_sample, parse_example, batch_samples
+from make_tfrecords import make_example
+
+
+class DREAMDataTest(unittest.TestCase):
+
+    target_code = 3
+
+    def test_encode_sample(self):
+        input_vec, output_vec, weights_vec = encode_sample([5, 6, 7, 4, 3, 8, 9], self.target_code)
+
+        self.assertTrue(np.array_equal(input_vec, [5, 6, 7, 4]))
+        self.assertTrue(np.array_equal(output_vec, [8, 9, 3, 3]))
+        self.assertTrue(np.array_equal(weights_vec, [1., 1., 0., 0.]))
+        self.assertEqual(weights_vec.dtype, np.float32)
+
+    def test_prepare_sample(self):
+        input_vec, output_vec, seq_len, weights_vec = prepare_sample([5, 6, 7, 4, 3, 8, 9], self.target_code)
+
+        self.assertEqual(input_vec.dtype, np.int32)
+        self.assertEqual(output_vec.dtype, np.int32)
+        self.assertEqual(seq_len, 4)
+        self.assertEqual(weights_vec.shape, (4, 1))
+
+    def test_example_round_trip(self):
+        sample = [5, 6, 7, 4, 3, 8, 9]
+        expected = prepare_sample(list(sample), self.target_code)
+
+        graph = tf.Graph()
+        with graph.as_default():
+            with tf.compat.v1.Session(graph=graph) as session:
+                serialized = make_example(list(sample), self.target_code).SerializeToString()
+                parsed = session.run(parse_example(tf.constant(serialized)))
+
+                self.assertEqual(len(parsed), 4)
+                self.assertTrue(np.array_equal(parsed[0], expected[0]))
+                self.assertTrue(np.array_equal(parsed[1], expected[1]))
+                self.assertEqual(parsed[2], expected[2])
+                self.assertTrue(np.array_equal(parsed[3], expected[3]))
+                self.assertEqual(parsed[0].dtype, np.int32)
+                self.assertEqual(parsed[1].dtype, np.int32)
+                self.assertEqual(parsed[3].dtype, np.float32)
+
+    def test_batch_samples(self):
+        short_sample = prepare_sample([5, 6, 3, 8], self.target_code)
+        long_sample = prepare_sample([5, 6, 7, 4, 3, 8, 9], self.target_code)
+
+        graph = tf.Graph()
+        with graph.as_default():
+            with tf.compat.v1.Session(graph=graph) as session:
+                dataset = tf.data.Dataset.from_tensors(short_sample).concatenate(
+                    tf.data.Dataset.from_tensors(long_sample)
+                )
+                batch = tf.compat.v1.data.make_one_shot_iterator(
+                    batch_samples(dataset, 2, self.target_code)
+                ).get_next()
+                input_vec, output_vec, seq_len, weights_vec = session.run(batch)
+
+                self.assertEqual(input_vec.shape, (2, 4))
+                self.assertEqual(output_vec.shape, (2, 4))
+                self.assertEqual(weights_vec.shape, (2, 4, 1))
+                self.assertEqual(seq_len, 4)
+
+                rows = {len(np.trim_zeros(row)): i for i, row in enumerate(weights_vec[:, :, 0])}
+                short_row = rows[1]
+                self.assertTrue(np.array_equal(input_vec[short_row], [5, 6, 3, 3]))
+                self.assertTrue(np.array_equal(output_vec[short_row], [8, 3, 3, 3]))
+                self.assertTrue(np.array_equal(weights_vec[short_row, :, 0], [1., 0., 0., 0.]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
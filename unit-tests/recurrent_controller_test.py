@@ -0,0 +1,73 @@
+import tensorflow as tf
+import numpy as np
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks', 'DREAM'))
+
+from recurrent_controller import RecurrentController, FusedRecurrentController
+
+
+class FusedRecurrentControllerTest(unittest.TestCase):
+
+    def test_construction(self):
+        graph = tf.Graph()
+        with graph.as_default():
+            with tf.compat.v1.Session(graph=graph) as session:
+                controller = FusedRecurrentController(10, 10, 2, 5, 2)
+
+                self.assertTrue(controller.has_recurrent_nn)
+                self.assertEqual(controller.nn_output_size, 256)
+                self.assertEqual(controller.kernel.op.name, 'shape_inference/basic_lstm_cell/kernel')
+                self.assertEqual(controller.bias.op.name, 'shape_inference/basic_lstm_cell/bias')
+                self.assertEqual(controller.kernel.get_shape().as_list(), [20 + 256, 4 * 256])
+                self.assertEqual(controller.bias.get_shape().as_list(), [4 * 256])
+
+    def test_matches_basic_lstm(self):
+        graph = tf.Graph()
+        with graph.as_default():
+            with tf.compat.v1.Session(graph=graph) as session:
+                with tf.compat.v1.variable_scope('basic'):
+                    controller = RecurrentController(10, 10, 2, 5, 2)
+                with tf.compat.v1.variable_scope('fused'):
+                    fcontroller = FusedRecurrentController(10, 10, 2, 5, 2)
+
+                kernel, bias = controller.lstm_cell.weights
+                kernel_value = np.random.uniform(-0.1, 0.1, (20 + 256, 4 * 256)).astype(np.float32)
+                bias_value = np.random.uniform(-0.1, 0.1, (4 * 256,)).astype(np.float32)
+
+                input_batch = tf.constant(np.random.uniform(0, 1, (2, 20)).astype(np.float32))
+                state = tf.compat.v1.nn.rnn_cell.LSTMStateTuple(
+                    tf.constant(np.random.uniform(-1, 1, (2, 256)).astype(np.float32)),
+                    tf.constant(np.random.uniform(-1, 1, (2, 256)).astype(np.float32))
+                )
+
+                output, new_state = controller.network_op(input_batch, state)
+                foutput, fnew_state = fcontroller.network_op(input_batch, state)
+
+                gradients = tf.gradients(tf.reduce_sum(output), [kernel, bias, input_batch])
+                fgradients = tf.gradients(tf.reduce_sum(foutput), [fcontroller.kernel, fcontroller.bias, input_batch])
+
+                self.assertTrue(all(gradient is not None for gradient in fgradients))
+
+                session.run(tf.compat.v1.global_variables_initializer())
+                session.run([
+                    kernel.assign(kernel_value),
+                    bias.assign(bias_value),
+                    fcontroller.kernel.assign(kernel_value),
+                    fcontroller.bias.assign(bias_value)
+                ])
+
+                o, s, g = session.run([output, new_state, gradients])
+                fo, fs, fg = session.run([foutput, fnew_state, fgradients])
+
+                self.assertEqual(fo.shape, (2, 256))
+                self.assertTrue(np.allclose(o, fo, atol=1e-5))
+                self.assertTrue(np.allclose(s[0], fs[0], atol=1e-5))
+                self.assertTrue(np.allclose(s[1], fs[1], atol=1e-5))
+                self.assertTrue(np.product([np.allclose(g[i], fg[i], atol=1e-4) for i in range(3)]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)